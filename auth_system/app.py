@@ -4,106 +4,184 @@ Blockchain AML Dashboard with Authentication
 A secure Flask application with login/logout functionality and SQLite database
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import Flask, Response, g, render_template, request, redirect, url_for, session, jsonify, send_from_directory
 from flask_cors import CORS
+import queue
 import sqlite3
 import bcrypt
+import fcntl
+import hashlib
 import os
 import secrets
+import threading
+import time
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)  # Secure secret key
 CORS(app)
 
+# All upstream calls share keep-alive connections; health probes run concurrently
+UPSTREAM_TIMEOUT = (0.5, 3.0)  # (connect, read) seconds; a dead endpoint fails fast
+SESSION = requests.Session()
+SESSION.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+_probe_pool = ThreadPoolExecutor(max_workers=4)
+
+# Latest upstream status, refreshed by a background thread
+HEALTH_REFRESH_INTERVAL = 2  # seconds
+_HEALTH_CACHE = {'ml_service': {'status': 'checking...'}, 'blockchain': 'checking...'}
+_health_monitor_pid = None
+_health_monitor_lock = threading.Lock()
+
 # Database setup
 DATABASE = '/home/abishek14/blockchain-aml-system/auth_system/users.db'
 
-def init_db():
-    """Initialize SQLite database with users table"""
-    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections in WAL mode"""
     
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
+    def __init__(self, database, size=8):
+        self.database = database
+        self._idle = queue.Queue(maxsize=size)
+        for _ in range(size):
+            # Connections are opened lazily so nothing is inherited across forks
+            self._idle.put(None)
     
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            email TEXT,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    ''')
+    def _connect(self):
+        conn = sqlite3.connect(self.database, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA cache_size=-65536')
+        conn.execute('PRAGMA mmap_size=268435456')  # serve reads from a 256 MB memory map
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
     
-    # Create sessions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            session_token TEXT UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Create default users
-    default_users = [
-        ('admin', 'admin123', 'admin@blockchain-aml.com', 'admin'),
-        ('user', 'password', 'user@blockchain-aml.com', 'user'),
-        ('demo', 'demo123', 'demo@blockchain-aml.com', 'user'),
-        ('aml_analyst', 'analyst2024', 'analyst@blockchain-aml.com', 'analyst')
-    ]
-    
-    for username, password, email, role in default_users:
-        # Check if user already exists
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-        if not cursor.fetchone():
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            cursor.execute('''
-                INSERT INTO users (username, password_hash, email, role)
-                VALUES (?, ?, ?, ?)
-            ''', (username, password_hash, email, role))
+    @contextmanager
+    def acquire(self):
+        """Borrow a connection, returning it to the pool afterwards"""
+        conn = self._idle.get()
+        try:
+            if conn is None:
+                conn = self._connect()
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+pool = ConnectionPool(DATABASE)
+
+# Default users with pre-computed bcrypt hashes (cost 10), so seeding never
+# pays for hashing. Regenerate with bcrypt.hashpw(password, bcrypt.gensalt(10)).
+DEFAULT_USERS = [
+    ('admin', b'$2b$10$cTRnmeeXcdm7jZGVqe49OubNbg2NtvOfHUstTihcCkWaksV/sH22.', 'admin@blockchain-aml.com', 'admin'),  # admin123
+    ('user', b'$2b$10$qZVKslE5ANACo26puRo7sO5dwQM.bixkA/0prwKiuhmWovg2roOC2', 'user@blockchain-aml.com', 'user'),  # password
+    ('demo', b'$2b$10$Ru1Rm5HA7HrukIa9VFdwVetRtpDEOfS5ocPDUrwqchtJQVTLDnN1K', 'demo@blockchain-aml.com', 'user'),  # demo123
+    ('aml_analyst', b'$2b$10$k1Tq8HZMg.WBsCaxawsMnOiBv.3JgYdtxJJxCu6JNpTcJnylWtj8C', 'analyst@blockchain-aml.com', 'analyst')  # analyst2024
+]
+
+def init_db():
+    """Initialize SQLite database with users table"""
+    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
     
-    conn.commit()
-    conn.close()
+    # File lock so concurrently starting processes initialize one at a time
+    with open(DATABASE + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        
+        conn = sqlite3.connect(DATABASE)
+        cursor = conn.cursor()
+        
+        # Create users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                email TEXT,
+                role TEXT DEFAULT 'user',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_login TIMESTAMP
+            )
+        ''')
+        
+        # Create sessions table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                session_token TEXT UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Explicit lookup index, independent of the UNIQUE constraint
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)')
+        
+        cursor.executemany('''
+            INSERT OR IGNORE INTO users (username, password_hash, email, role)
+            VALUES (?, ?, ?, ?)
+        ''', DEFAULT_USERS)
+        
+        conn.commit()
+        conn.close()
     print("Database initialized with default users:")
     print("- admin / admin123 (Admin)")
     print("- user / password (User)")  
     print("- demo / demo123 (User)")
     print("- aml_analyst / analyst2024 (Analyst)")
 
-def verify_password(password, password_hash):
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash)
+# Successful bcrypt verifications keyed by (username, sha256(password)).
+# The verified hash is stored alongside, so a password change invalidates the
+# entry; failed attempts are never cached.
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_MAXSIZE = 1024
+_auth_cache = {}
+_auth_cache_lock = threading.Lock()
+
+def verify_password(username, password, password_hash):
+    """Verify password against hash, skipping bcrypt for recently verified logins"""
+    key = (username, hashlib.sha256(password.encode('utf-8')).hexdigest())
+    now = time.monotonic()
+    with _auth_cache_lock:
+        cached = _auth_cache.get(key)
+    if cached and cached[0] == password_hash and cached[1] > now:
+        return True
+    
+    if not bcrypt.checkpw(password.encode('utf-8'), password_hash):
+        return False
+    
+    with _auth_cache_lock:
+        _auth_cache.pop(key, None)
+        if len(_auth_cache) >= AUTH_CACHE_MAXSIZE:
+            # Dicts keep insertion order, so the first key is the oldest entry
+            _auth_cache.pop(next(iter(_auth_cache)))
+        _auth_cache[key] = (password_hash, now + AUTH_CACHE_TTL)
+    return True
 
 def get_user(username):
     """Get user from database"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, password_hash, email, role FROM users WHERE username = ?', (username,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    with pool.acquire() as conn:
+        return conn.execute('SELECT id, username, password_hash, email, role FROM users WHERE username = ?', (username,)).fetchone()
 
 def update_last_login(user_id):
     """Update user's last login timestamp"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
-    conn.commit()
-    conn.close()
+    with pool.acquire() as conn:
+        conn.execute('UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?', (user_id,))
 
 def is_authenticated():
     """Check if user is authenticated"""
     return 'user_id' in session and 'username' in session
 
+@app.before_request
+def stamp_request_time():
+    """Format the request timestamp once for every handler that needs it"""
+    g.now_iso = datetime.now().isoformat()
+
 @app.route('/')
 def index():
     """Redirect to dashboard if authenticated, otherwise to login"""
@@ -119,12 +197,12 @@ def login():
         password = request.form['password']
         
         user = get_user(username)
-        if user and verify_password(password, user[2]):  # user[2] is password_hash
+        if user and verify_password(username, password, user[2]):  # user[2] is password_hash
             # Login successful
             session['user_id'] = user[0]
             session['username'] = user[1]
             session['role'] = user[4]
-            session['login_time'] = datetime.now().isoformat()
+            session['login_time'] = g.now_iso
             
             update_last_login(user[0])
             
@@ -158,26 +236,67 @@ def api_health():
     if not is_authenticated():
         return jsonify({'error': 'Authentication required'}), 401
     
+    # Upstream status comes from the background monitor, never a blocking call
+    return jsonify({
+        'ml_service': _HEALTH_CACHE['ml_service'],
+        'blockchain': _HEALTH_CACHE['blockchain'],
+        'user': session['username'],
+        'role': session['role'],
+        'timestamp': g.now_iso
+    })
+
+def probe_ml_service():
+    """Fetch the ML service health payload"""
     try:
-        # Check ML service
-        ml_response = requests.get('http://127.0.0.1:8000/health', timeout=5)
-        ml_status = ml_response.json() if ml_response.status_code == 200 else {'status': 'offline'}
-        
-        # Check blockchain
-        blockchain_response = requests.post('http://127.0.0.1:8545', 
+        ml_response = SESSION.get('http://127.0.0.1:8000/health', timeout=UPSTREAM_TIMEOUT)
+        return {'ml_service': ml_response.json() if ml_response.status_code == 200 else {'status': 'offline'}}
+    except requests.exceptions.ReadTimeout:
+        return {'ml_service': {'status': 'timeout'}}  # reachable but not answering in time
+    except (requests.RequestException, ValueError):
+        return {'ml_service': {'status': 'offline'}}
+
+def probe_blockchain():
+    """Report whether the local JSON-RPC node answers"""
+    try:
+        blockchain_response = SESSION.post('http://127.0.0.1:8545', 
                                           json={"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1},
-                                          timeout=5)
-        blockchain_status = 'online' if blockchain_response.status_code == 200 else 'offline'
-        
-        return jsonify({
-            'ml_service': ml_status,
-            'blockchain': blockchain_status,
-            'user': session['username'],
-            'role': session['role'],
-            'timestamp': datetime.now().isoformat()
-        })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+                                          timeout=UPSTREAM_TIMEOUT)
+        return {'blockchain': 'online' if blockchain_response.status_code == 200 else 'offline'}
+    except requests.exceptions.ReadTimeout:
+        return {'blockchain': 'timeout'}
+    except requests.RequestException:
+        return {'blockchain': 'offline'}
+
+def probe_all():
+    """Probe the ML service and blockchain in parallel"""
+    ml_future = _probe_pool.submit(probe_ml_service)
+    blockchain_future = _probe_pool.submit(probe_blockchain)
+    wait((ml_future, blockchain_future), timeout=sum(UPSTREAM_TIMEOUT) + 0.5)
+    status = {'ml_service': {'status': 'offline'}, 'blockchain': 'offline'}
+    for future in (ml_future, blockchain_future):
+        if future.done():
+            status.update(future.result())
+    return status
+
+def _health_monitor():
+    while True:
+        try:
+            _HEALTH_CACHE.update(probe_all())
+        except Exception as e:
+            print(f"Health monitor error: {e}")
+        time.sleep(HEALTH_REFRESH_INTERVAL)
+
+@app.before_request
+def ensure_health_monitor():
+    """Start the background health monitor once per process"""
+    global _health_monitor_pid
+    # Threads don't survive fork, so key on the pid rather than a plain flag
+    if _health_monitor_pid == os.getpid():
+        return
+    with _health_monitor_lock:
+        if _health_monitor_pid != os.getpid():
+            threading.Thread(target=_health_monitor, name='health-monitor', daemon=True).start()
+            _health_monitor_pid = os.getpid()
 
 @app.route('/api/predict', methods=['POST'])
 def api_predict():
@@ -186,11 +305,16 @@ def api_predict():
         return jsonify({'error': 'Authentication required'}), 401
     
     try:
-        # Forward request to ML service
-        ml_response = requests.post('http://127.0.0.1:8000/predict', 
-                                   json=request.json, 
-                                   timeout=10)
-        return jsonify(ml_response.json()), ml_response.status_code
+        # Forward request to ML service as raw bytes, without re-encoding JSON
+        ml_response = SESSION.post('http://127.0.0.1:8000/predict', 
+                                   data=request.get_data(), 
+                                   headers={'Content-Type': 'application/json'},
+                                   timeout=UPSTREAM_TIMEOUT)
+        return Response(ml_response.content, status=ml_response.status_code, mimetype='application/json')
+    except requests.exceptions.ReadTimeout:
+        return jsonify({'error': 'ML service timed out'}), 504
+    except requests.exceptions.ConnectionError:
+        return jsonify({'error': 'ML service unavailable'}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -199,11 +323,9 @@ def serve_static(filename):
     """Serve static files"""
     return send_from_directory('/home/abishek14/blockchain-aml-system/auth_system/static', filename)
 
-# Initialize database on startup
-init_db()
-
 if __name__ == '__main__':
     print("🔐 Starting Blockchain AML Authentication Server...")
+    init_db()
     print("🌐 Dashboard will be available at: http://127.0.0.1:5000")
     print("👤 Default login credentials:")
     print("   • admin / admin123")
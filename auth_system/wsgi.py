@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+WSGI entrypoint for the Blockchain AML authentication server
+
+Serve with gunicorn:
+    gunicorn -w 4 -k gthread --threads 8 -b 127.0.0.1:5000 --preload wsgi:application
+
+With --preload this module is imported once in the master process, so the
+database is initialized a single time before the workers fork. init_db() also
+takes a file lock, so starting without --preload stays safe.
+"""
+
+from app import app, init_db
+
+init_db()
+application = app
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""
+WSGI entrypoint for the Blockchain AML dashboard
+
+Serve with gunicorn so bcrypt logins and upstream calls don't block each other:
+    gunicorn -w 4 -k gthread --threads 8 -b 127.0.0.1:5000 --preload wsgi:application
+
+With --preload this module is imported once in the master process, so the
+database is initialized a single time before the workers fork.
+"""
+
+from app import app, init_db
+
+init_db()
+application = app